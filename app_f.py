@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+from numba import njit
 from pathlib import Path
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 from streamlit_plotly_events import plotly_events
 import requests
 
@@ -10,9 +13,53 @@ st.set_page_config(layout = "wide")
 
 BASE_DIR = Path(__file__).parent
 
-@st.cache_data
+mag_bins_dot = [5.0, 5.15, 5.35, 5.55, 5.75, 6.0, 6.15, 6.35, 6.55, 6.75, 7.0, 7.5, float("inf")]
+mag_labels_dot = ["5.0–5.1","5.2–5.3","5.4–5.5","5.6–5.7","5.8–5.9","6.0–6.1","6.2–6.3","6.4–6.5","6.6-6.7","6.8-6.9","7.0-7.5","7.5+"]
+mag_bins_pie = [5.0, 5.15, 5.35, 5.55, 5.75, 6.0, 6.15, 6.35, 6.55, float("inf")]
+mag_labels_pie = ["5.0–5.1","5.2–5.3","5.4–5.5","5.6–5.7","5.8–5.9","6.0–6.1","6.2–6.3","6.4–6.5","6.6+"]
+
+color_map_dots = {
+    "5.0–5.1": "#0B7C38",
+    "5.2–5.3": "#0FAE3A",
+    "5.4–5.5": "#00FF2A",
+    "5.6–5.7": "#B6FF00",
+    "5.8–5.9": "#FFF200",
+    "6.0–6.1": "#FFC300",
+    "6.2–6.3": "#FF8A00",
+    "6.4–6.5": "#FF4D00",
+    "6.6-6.7": "#FF0000",
+    "6.8-6.9": "#BD0202",
+    "7.0-7.5": "#740C0C",
+    "7.5+":    "#000000",}
+
+pie_color_map = {
+    "5.0–5.1": color_map_dots["5.0–5.1"],
+    "5.2–5.3": color_map_dots["5.2–5.3"],
+    "5.4–5.5": color_map_dots["5.4–5.5"],
+    "5.6–5.7": color_map_dots["5.6–5.7"],
+    "5.8–5.9": color_map_dots["5.8–5.9"],
+    "6.0–6.1": color_map_dots["6.0–6.1"],
+    "6.2–6.3": color_map_dots["6.2–6.3"],
+    "6.4–6.5": color_map_dots["6.4–6.5"],
+    "6.6+": color_map_dots["6.8-6.9"],}
+
+count_bins_chor = [-1, 1, 3, 6, 10, 20, float("inf")]
+count_labels_chor = ["1", "2–3", "4–6", "7–10", "11–20", "21+"]
+color_map_counts = {
+    "1":   "#4ae1f5",
+    "2–3":   "#3bbcd9",
+    "4–6":   "#2b88b8",
+    "7–10":  "#1c5f9a",
+    "11–20": "#123a73",
+    "21+":   "#061849",}
+
+@st.cache_resource
 def load_data(path: str) -> pd.DataFrame:
-    return pd.read_csv(path)
+    df = pd.read_parquet(path)
+    df["magnitude_category"] = pd.cut(df["magnitude"], bins = mag_bins_dot, labels = mag_labels_dot, right = False)
+    df["mag_cluster"] = pd.cut(df["magnitude"], bins = mag_bins_pie, labels = mag_labels_pie, right = False)
+    df["region"] = df["region"].str.title().str.strip().astype("category")
+    return df
 
 @st.cache_data(ttl = 24 * 3600)
 def load_tectonics(url: str) -> dict:
@@ -20,7 +67,217 @@ def load_tectonics(url: str) -> dict:
     r.raise_for_status()
     return r.json()
 
-df = load_data(BASE_DIR/"earthquakes_merged_f.csv")
+@st.cache_data(ttl = 24 * 3600)
+def build_tectonic_trace(url: str) -> go.Scattermap:
+    tectonic_data = load_tectonics(url)
+    # NaN rows split the boundaries into separate lines; plotly ships them as NaNs inside the float32 typed array (not JSON nulls) and plotly.js treats them as gaps
+    gap = np.full((1, 2), np.nan, dtype = np.float32)
+    segments = []
+    for feature in tectonic_data['features']:
+        if feature['geometry']['type'] == 'LineString':
+            coords = np.asarray(feature['geometry']['coordinates'], dtype = np.float32)
+            segments += [coords[:, :2], gap]
+    points = np.concatenate(segments) if segments else np.empty((0, 2), dtype = np.float32)
+    return go.Scattermap(
+        lon = points[:, 0],
+        lat = points[:, 1],
+        mode = 'lines',
+        line = dict(width = 2, color = 'red'),
+        name = 'Tectonic Boundaries',
+        showlegend = False,
+        hoverinfo = 'skip')
+
+@njit(cache = True)
+def top3_per_year(year_idx: np.ndarray, mags: np.ndarray, n_years: int) -> np.ndarray:
+    # one pass keeping the three largest magnitudes per year in descending order; -inf marks an empty slot
+    out = np.full((n_years, 3), -np.inf, dtype = np.float32)
+    for i in range(mags.size):
+        m = mags[i]
+        if np.isnan(m):
+            continue
+        r = out[year_idx[i]]
+        if m > r[2]:
+            r[2] = m
+            if r[2] > r[1]:
+                r[1], r[2] = r[2], r[1]
+                if r[1] > r[0]:
+                    r[0], r[1] = r[1], r[0]
+    for y in range(n_years):
+        for k in range(3):
+            if out[y, k] == -np.inf:
+                out[y, k] = np.nan
+    return out
+
+@st.cache_data
+def build_year_summary(path: str) -> tuple:
+    df = load_data(path)
+    region_counts = (
+        df.dropna(subset = ["region"])
+          .groupby(["year", "region"], observed = True).size()
+          .reset_index(name = "n"))
+    top_region = (
+        region_counts.loc[region_counts.groupby("year")["n"].idxmax(), ["year", "region"]]
+          .rename(columns = {"region": "top_region"}))
+    per_year_df = (
+        df.groupby("year")
+          .size()
+          .reset_index(name = "amount")
+          .sort_values("year"))
+    per_year_df = per_year_df.merge(top_region, on = "year", how = "left")
+
+    # top-3 magnitudes per year, NaN where a year has fewer than 3 events
+    year_idx = np.searchsorted(per_year_df["year"].to_numpy(), df["year"].to_numpy())
+    per_year_df[["m1", "m2", "m3"]] = top3_per_year(year_idx, df["magnitude"].to_numpy(np.float32), len(per_year_df))
+    custom = per_year_df[["year", "amount", "top_region", "m1", "m2", "m3"]].to_numpy()
+
+    # plain lists: plotly_events renders with its bundled plotly.js 1.x, which can't decode typed-array (bdata) JSON
+    years_barchart = per_year_df["year"].tolist()
+    amount_barchart = per_year_df["amount"].tolist()
+    return per_year_df, custom, years_barchart, amount_barchart
+
+@st.cache_resource
+def split_by_year(path: str) -> dict[int, pd.DataFrame]:
+    df = load_data(path)
+    return {int(year): sub for year, sub in df.groupby("year")}
+
+@st.cache_data
+def precompute_region_counts(path: str) -> dict[int | None, pd.DataFrame]:
+    frames = {None: load_data(path), **split_by_year(path)}
+    region_counts = {}
+    for year, sub in frames.items():
+        by_region = sub.dropna(subset = ["region"]).groupby("region", observed = True).size().reset_index(name = "count")
+        by_region["count_bin"] = pd.cut(by_region["count"], bins = count_bins_chor, labels = count_labels_chor)
+        region_counts[year] = by_region
+    return region_counts
+
+def filter_year(path: str, year: int | None) -> pd.DataFrame:
+    if year is None:
+        return load_data(path)
+    return split_by_year(path)[year]
+
+@st.cache_data
+def build_dot_map(path: str, year: int | None) -> str:
+    df_filtered = filter_year(path, year)
+    # one trace for all points, colored by category code; the last palette entry catches unbinned (code -1) magnitudes
+    dot_palette = np.array([color_map_dots[label] for label in mag_labels_dot] + ["#808080"])
+    # draw weakest first so the strongest quakes stay on top, as with px's one-trace-per-category order
+    order = np.argsort(df_filtered["magnitude"].to_numpy(), kind = "stable")
+    dot_map = go.Figure(data = [go.Scattermap(
+        lat = df_filtered["latitude"].to_numpy()[order],
+        lon = df_filtered["longitude"].to_numpy()[order],
+        customdata = df_filtered["magnitude"].to_numpy()[order],
+        mode = "markers",
+        marker = dict(size = 8, color = dot_palette[df_filtered["magnitude_category"].cat.codes.to_numpy()[order]]),
+        hovertemplate = "magnitude=%{customdata:.1f}<extra></extra>",
+        showlegend = False)])
+    # single-point placeholder traces so the legend still lists the categories present
+    for label in df_filtered["magnitude_category"].cat.remove_unused_categories().cat.categories:
+        dot_map.add_trace(go.Scattermap(
+            lat = [None],
+            lon = [None],
+            mode = "markers",
+            marker = dict(size = 8, color = color_map_dots[label]),
+            name = label,
+            hoverinfo = "skip"))
+    dot_map.update_layout(
+        map = dict(center = {"lat": 50, "lon": 15}, zoom = 2.6),
+        height = 600,
+        margin = dict(t = 60),
+        legend = dict(title = dict(text = "Magnitude Category"), tracegroupgap = 0),)
+    return dot_map.to_json()
+
+@st.cache_data
+def build_choropleth_map(path: str, year: int | None) -> str:
+    by_region = precompute_region_counts(path)[year]
+    choropleth_map = px.choropleth(
+        by_region,
+        locations = "region",
+        locationmode = "country names",
+        color = "count_bin",
+        color_discrete_map = color_map_counts,
+        category_orders = {"count_bin": count_labels_chor},
+        title = "Amount of earthquakes in European countries/regions in the selected year",
+        labels = {"count": "Amount", "count_bin": "Number of Events"},)
+    choropleth_map.update_geos(
+        fitbounds = "locations",
+        projection_type = "natural earth",
+        showcountries = True)
+    choropleth_map.update_traces(
+        hovertemplate = "<extra></extra>")
+    choropleth_map.update_layout(
+        title = dict(
+            font = dict(size = 20, color = "black", family = "Arial, sans-serif"),),)
+    return choropleth_map.to_json()
+
+@st.cache_data
+def build_mini_map(path: str, year: int | None) -> str:
+    df_filtered = filter_year(path, year)
+    mag = df_filtered["magnitude"].to_numpy()
+    valid = ~(np.isnan(mag) | np.isnan(df_filtered["latitude"].to_numpy()) | np.isnan(df_filtered["longitude"].to_numpy()))
+    idx = np.flatnonzero(valid)
+    k = min(3, idx.size)
+    top_idx = idx[np.argpartition(-mag[idx], k - 1)[:k]] if k else idx
+
+    top3 = df_filtered.iloc[top_idx].sort_values("magnitude_category")
+    mini_map = px.scatter_map(
+        top3,
+        lat = "latitude",
+        lon = "longitude",
+        color = "magnitude_category",
+        color_discrete_map = color_map_dots,
+        hover_data = {"latitude": ":.3f", "longitude": ":.3f", "magnitude": ":.1f", "depth": ":.1f", "stations_used": True, "region": True, "magnitude_category": False},
+        zoom = 3,
+        height = 400,)
+    mini_map.update_traces(marker = dict(size = 14))
+    mini_map.update_layout(
+        legend = dict(
+            title = dict(text = "Magnitude Category"),),)
+    return mini_map.to_json()
+
+@st.fragment
+def render_pie(df_filtered: pd.DataFrame) -> None:
+    regions = ["All"] + df_filtered["region"].cat.remove_unused_categories().cat.categories.tolist()
+    st.markdown("")
+
+    st.markdown("##### Please select a country/region for the pie chart")
+    region_selected = st.selectbox(
+        "",
+        options=regions,
+        key = "region_select")
+
+    if region_selected == "All":
+        df_pie_filtered = df_filtered
+    else:
+        df_pie_filtered = df_filtered[df_filtered["region"] == region_selected]
+
+    if df_pie_filtered.empty:
+        st.warning("No data for the selected year(s) and region.")
+    else:
+        df_pie = (
+            df_pie_filtered
+            .groupby("mag_cluster", observed = True)
+            .size()
+            .reset_index(name = "count"))
+        fig_pie = px.pie(
+            df_pie,
+            values = "count",
+            names = "mag_cluster",
+            color = "mag_cluster",
+            category_orders = {"mag_cluster": mag_labels_pie},
+            color_discrete_map = pie_color_map,
+            title = "Distribution of earthquake magnitudes in the selected country/region")
+        fig_pie.update_layout(
+            legend = dict(
+                title = dict(text = "Magnitude Category"),),
+            title = dict(
+                font = dict(size = 20),
+                x = 0.45,  
+                xanchor = 'center'))
+
+
+        st.plotly_chart(fig_pie, width = "stretch")
+
+DATA_PATH = BASE_DIR/"earthquakes_merged_f.parquet"
 
 st.title("Earthquakes in Europe")
 st.write("This app presents earthquakes of magnitude 5.0 and higher in Europe recorded between 2015 and 2024. "
@@ -28,31 +285,8 @@ st.write("This app presents earthquakes of magnitude 5.0 and higher in Europe re
 
 col_left, col_right = st.columns([5, 4])
 
-top_region = (
-    df.dropna(subset = ["region"])
-      .groupby(["year", "region"]).size()
-      .reset_index(name = "n")
-      .sort_values(["year", "n"], ascending = [True, False])
-      .drop_duplicates("year")[["year", "region"]]
-      .rename(columns = {"region": "top_region"}))
-top_mags = (
-    df.groupby("year")["magnitude"]
-      .apply(lambda s: s.nlargest(3).to_list() + [None, None, None])
-      .apply(lambda L: L[:3])
-      .apply(pd.Series)
-      .reset_index())
-top_mags.columns = ["year", "m1", "m2", "m3"]
-
-per_year_df = (
-    df.groupby("year")
-      .size()
-      .reset_index(name = "amount")
-      .sort_values("year"))
-per_year_df = per_year_df.merge(top_region, on = "year", how = "left").merge(top_mags, on = "year", how = "left")
-custom = per_year_df[["year", "amount", "top_region", "m1", "m2", "m3"]].to_numpy()
-
-years_barchart = per_year_df["year"].astype(int).tolist()
-amount_barchart = per_year_df["amount"].tolist()
+per_year_df, custom, years_barchart, amount_barchart = build_year_summary(DATA_PATH)
+
 main_barchart = go.Figure(data = [go.Bar(
     x = years_barchart, 
     y = amount_barchart,
@@ -99,7 +333,7 @@ with col_left:
         key = f"year_bar_selection_{st.session_state.barchart_version}")
     
 selected_year = int(selected[0]["x"]) if selected else None
-df_filtered = df.copy() if selected_year is None else df[df["year"] == selected_year].copy()
+df_filtered = filter_year(DATA_PATH, selected_year)
 
 with col_left:
     st.write(f"**Selected year: {selected_year if selected_year is not None else 'all years'}**")
@@ -111,185 +345,29 @@ with col_left:
     with right_sub_col:
         show_tectonics = st.checkbox("Show Tectonic Plate Boundaries", value=False)
 
-mag_bins_dot = [5.0, 5.15, 5.35, 5.55, 5.75, 6.0, 6.15, 6.35, 6.55, 6.75, 7.0, 7.5, float("inf")]
-mag_labels_dot = ["5.0–5.1","5.2–5.3","5.4–5.5","5.6–5.7","5.8–5.9","6.0–6.1","6.2–6.3","6.4–6.5","6.6-6.7","6.8-6.9","7.0-7.5","7.5+"]
- 
-df_filtered['magnitude_category'] = pd.cut( df_filtered['magnitude'],
-        bins = mag_bins_dot, 
-        labels = mag_labels_dot,
-        right = False)
-
-color_map_dots = {
-    "5.0–5.1": "#0B7C38",
-    "5.2–5.3": "#0FAE3A",
-    "5.4–5.5": "#00FF2A",
-    "5.6–5.7": "#B6FF00",
-    "5.8–5.9": "#FFF200",
-    "6.0–6.1": "#FFC300",
-    "6.2–6.3": "#FF8A00",
-    "6.4–6.5": "#FF4D00",
-    "6.6-6.7": "#FF0000",
-    "6.8-6.9": "#BD0202",
-    "7.0-7.5": "#740C0C",
-    "7.5+":    "#000000",}
-   
-dot_map = px.scatter_map(
-    df_filtered,
-    category_orders = {"magnitude_category": mag_labels_dot},
-    lat = "latitude",
-    lon = "longitude",
-    color = "magnitude_category",
-    color_discrete_map = color_map_dots,
-    hover_data = {"latitude": False, "longitude": False, "magnitude_category": False, "magnitude": True},
-    zoom = 2.6,
-    center = {"lat": 50, "lon": 15},
-    height = 600,)
-dot_map.update_layout(
-    legend = dict(title = dict(text = "Magnitude Category")),)
-
-dot_map.update_traces(marker = dict(size = 8))
+dot_map = pio.from_json(build_dot_map(DATA_PATH, selected_year))
 if show_tectonics:
     url = "https://raw.githubusercontent.com/fraxen/tectonicplates/master/GeoJSON/PB2002_boundaries.json"
     try:
-        tectonic_data = load_tectonics(url)
-        for feature in tectonic_data['features']:
-            coords = feature['geometry']['coordinates']
-            if feature['geometry']['type'] == 'LineString':
-                lons = [coord[0] for coord in coords]
-                lats = [coord[1] for coord in coords]
-                dot_map.add_trace(go.Scattermap(
-                    lon = lons,
-                    lat = lats,
-                    mode = 'lines',
-                    line = dict(width = 2, color = 'red'),
-                    name = 'Tectonic Boundaries',
-                    showlegend = False,
-                    hoverinfo = 'skip'))
+        dot_map.add_trace(build_tectonic_trace(url))
     except Exception as e:
         st.warning(f"Could not load tectonic plate data: {e}")
 with col_left:
     st.plotly_chart(dot_map, width = "stretch", config = {"displayModeBar": False})
 
-df_regions = df_filtered.dropna(subset = ["region"]).copy()
-df_regions["region"] = df_regions["region"].str.title().str.strip()
-by_region = df_regions.groupby("region").size().reset_index(name = "count")
-count_bins_chor = [-1, 1, 3, 6, 10, 20, float("inf")]
-count_labels_chor = ["1", "2–3", "4–6", "7–10", "11–20", "21+"]
-by_region["count_bin"] = pd.cut(by_region["count"], bins = count_bins_chor, labels = count_labels_chor)
-color_map_counts = {
-    "1":   "#4ae1f5",
-    "2–3":   "#3bbcd9",
-    "4–6":   "#2b88b8",
-    "7–10":  "#1c5f9a",
-    "11–20": "#123a73",
-    "21+":   "#061849",}
-
-choropleth_map = px.choropleth(
-    by_region,
-    locations = "region",
-    locationmode = "country names",
-    color = "count_bin",
-    color_discrete_map = color_map_counts,
-    category_orders = {"count_bin": count_labels_chor},
-    title = "Amount of earthquakes in European countries/regions in the selected year",
-    labels = {"count": "Amount", "count_bin": "Number of Events"},)
-choropleth_map.update_geos(
-    fitbounds = "locations",
-    projection_type = "natural earth",
-    showcountries = True)
-choropleth_map.update_traces(
-    hovertemplate = "<extra></extra>")
-choropleth_map.update_layout(
-    title = dict(
-        font = dict(size = 20, color = "black", family = "Arial, sans-serif"),),)
+choropleth_map = pio.from_json(build_choropleth_map(DATA_PATH, selected_year))
 with col_right:
-    for _ in range(6):
-        st.write("")
+    st.markdown("<div style='margin-top:6em'></div>", unsafe_allow_html = True)
     st.plotly_chart(choropleth_map, width = "stretch", config = {"displayModeBar": False})
 
-top3 = (
-    df_filtered
-    .dropna(subset = ["latitude", "longitude", "magnitude"])
-    .nlargest(3, "magnitude")
-    .copy())
-
-top3 = top3.sort_values("magnitude_category")
-mini_map = px.scatter_map(
-    top3,
-    lat = "latitude",
-    lon = "longitude",
-    color = "magnitude_category",
-    color_discrete_map = color_map_dots,
-    hover_data = {"magnitude": True, "depth": True, "stations_used": True, "region": True, "magnitude_category": False},
-    zoom = 3,
-    height = 400,)
-mini_map.update_traces(marker = dict(size = 14))
-mini_map.update_layout(
-    legend = dict(
-        title = dict(text = "Magnitude Category"),),)
-
+mini_map = pio.from_json(build_mini_map(DATA_PATH, selected_year))
 with col_right:
-    for _ in range(4):
-        st.write("")
+    st.markdown("<div style='margin-top:4em'></div>", unsafe_allow_html = True)
     st.markdown("#### Top 3 strongest earthquakes")
     st.plotly_chart(mini_map, width = "stretch", config = {"displayModeBar": False})
 
-regions = ["All"] + sorted(df_filtered["region"].dropna().unique())
-st.markdown("")
-
-st.markdown("##### Please select a country/region for the pie chart")
-region_selected = st.selectbox(
-    "",
-    options=regions,
-    key = "region_select")
-
-if region_selected == "All":
-    df_pie_filtered = df_filtered.copy()
-else:
-    df_pie_filtered = df_filtered[df_filtered["region"] == region_selected].copy()
-     
-mag_bins_pie = [5.0, 5.15, 5.35, 5.55, 5.75, 6.0, 6.15, 6.35, 6.55, float("inf")]
-mag_labels_pie = ["5.0–5.1","5.2–5.3","5.4–5.5","5.6–5.7","5.8–5.9","6.0–6.1","6.2–6.3","6.4–6.5","6.6+"]  
-
-df_pie_filtered["mag_cluster"] = pd.cut(df_pie_filtered["magnitude"], bins = mag_bins_pie, labels = mag_labels_pie, right = False)
-
-pie_color_map = {
-    "5.0–5.1": color_map_dots["5.0–5.1"],
-    "5.2–5.3": color_map_dots["5.2–5.3"],
-    "5.4–5.5": color_map_dots["5.4–5.5"],
-    "5.6–5.7": color_map_dots["5.6–5.7"],
-    "5.8–5.9": color_map_dots["5.8–5.9"],
-    "6.0–6.1": color_map_dots["6.0–6.1"],
-    "6.2–6.3": color_map_dots["6.2–6.3"],
-    "6.4–6.5": color_map_dots["6.4–6.5"],
-    "6.6+": color_map_dots["6.8-6.9"],}
-
-if df_pie_filtered.empty:
-    st.warning("No data for the selected year(s) and region.")
-else:
-    df_pie = (
-        df_pie_filtered
-        .groupby("mag_cluster")
-        .size()
-        .reset_index(name = "count"))
-    fig_pie = px.pie(
-        df_pie,
-        values = "count",
-        names = "mag_cluster",
-        color = "mag_cluster",
-        category_orders = {"mag_cluster": mag_labels_pie},
-        color_discrete_map = pie_color_map,
-        title = "Distribution of earthquake magnitudes in the selected country/region")
-    fig_pie.update_layout(
-        legend = dict(
-            title = dict(text = "Magnitude Category"),),
-        title = dict(
-            font = dict(size = 20),
-            x = 0.45,  
-            xanchor = 'center'))
-
+render_pie(df_filtered)
 
-    st.plotly_chart(fig_pie, width = "stretch")
 
 
 